@@ -0,0 +1,74 @@
+import glob
+import gzip
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# أرشيف الصفحات الخام (Captures) 🗄️
+# ==========================================
+# كل تشغيل يضيف سجلات JSON (سطر لكل مصدر) إلى ملف مضغوط يومي:
+#   captures/2025-11-21.jsonl.gz
+# الإضافة لملف gzip تنشئ عضواً جديداً فيه، ويُقرأ الملف كاملاً كتدفق واحد.
+# في GitHub Actions يبدأ كل تشغيل بمجلد فارغ، فيرفع main.yml ملف التشغيل
+# كـ artifact باسم captures-<run_id>، وتقرأ replay.py مجلد التنزيل كاملاً.
+
+def save_captures(archive_dir, run_time, pages):
+    """
+    حفظ صفحات تشغيل واحد: run_time بتوقيت اليمن، و pages قائمة (url, html)
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{run_time.strftime('%Y-%m-%d')}.jsonl.gz")
+    run_id = run_time.strftime("%Y-%m-%dT%H:%M:%S")
+
+    with gzip.open(path, 'at', encoding='utf-8') as f:
+        for url, html in pages:
+            if not html: continue
+            record = {"run": run_id, "url": url, "html": html}
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return path
+
+def _first_run(path):
+    """معرّف أول تشغيل في الملف، لترتيب ملفات نفس اليوم القادمة من artifacts مختلفة"""
+    opener = gzip.open if path.endswith(".gz") else open
+    try:
+        with opener(path, 'rt', encoding='utf-8') as f:
+            return json.loads(f.readline()).get("run", "")
+    except (EOFError, gzip.BadGzipFile, json.JSONDecodeError):
+        return ""
+
+def capture_files(paths):
+    """
+    توسيع المجلدات (بما فيها مجلدات artifacts الفرعية) إلى ملفات الأرشيف
+    مرتبة زمنياً حسب اليوم ثم أول تشغيل في كل ملف
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, "**", "*.jsonl.gz"), recursive=True))
+        else:
+            files.append(path)
+    return sorted(files, key=lambda p: (os.path.basename(p), _first_run(p)))
+
+def iter_captures(paths):
+    """
+    قراءة السجلات واحداً تلو الآخر دون تحميل الأرشيف في الذاكرة.
+    السطور التالفة، أو نهاية ملف مقطوعة (تشغيل توقف أثناء الكتابة)، تُتجاوز مع تحذير.
+    """
+    for path in capture_files(paths):
+        opener = gzip.open if path.endswith(".gz") else open
+        try:
+            with opener(path, 'rt', encoding='utf-8') as f:
+                for n, line in enumerate(f, 1):
+                    line = line.strip()
+                    if not line: continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning(f"⚠️ سطر تالف في {path}:{n}، تم تجاوزه")
+                        continue
+                    yield record
+        except (EOFError, gzip.BadGzipFile) as e:
+            logger.warning(f"⚠️ ملف أرشيف مقطوع أو تالف {path}: {e}، تم تجاوز بقيته")
@@ -3,14 +3,16 @@ from firebase_admin import credentials, db, messaging
 import yfinance as yf
 import asyncio
 import aiohttp
-from bs4 import BeautifulSoup
-import re
 import statistics
 from datetime import datetime, timedelta
 import os
 import sys
 import logging
 from dotenv import load_dotenv
+from outbox import open_outbox
+from stats import open_stats, trend_of
+from parsing import parse_rates_from_html, add_to_pool, calculate_final_rate, empty_pool
+from archive import save_captures
 
 # ضبط الترميز لويندوز (لحل مشكلة الإيموجي)
 sys.stdout.reconfigure(encoding='utf-8')
@@ -43,6 +45,7 @@ DATABASE_URL = os.getenv('FIREBASE_DATABASE_URL')
 TELEGRAM_BOT_TOKEN = os.getenv('BOT_TOKEN')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
 SAFETY_THRESHOLD = int(os.getenv('SAFETY_THRESHOLD', '50'))
+CAPTURE_DIR = os.getenv('CAPTURE_DIR')  # اختياري: مجلد أرشيف الصفحات الخام
 
 # التحقق من وجود المتغيرات الضرورية
 required_vars = {
@@ -106,54 +109,6 @@ async def fetch_url(session, url):
     except: pass
     return ""
 
-def parse_rates_from_html(html, url_source):
-    soup = BeautifulSoup(html, 'html.parser')
-    text = soup.get_text()
-    
-    page_data = {
-        'sanaa': {'usd': [], 'sar': []},
-        'aden': {'usd': [], 'sar': []}
-    }
-
-    rows = soup.find_all(['tr', 'div', 'p', 'span']) 
-    found_log = [] 
-
-    for row in rows:
-        row_text = row.get_text().strip()
-        nums = [int(n) for n in re.findall(r'\d{3,4}', row_text)]
-        nums = [n for n in nums if n not in list(range(2010, 2031))]
-        
-        if len(nums) < 1: continue
-
-        currency = None
-        if any(x in row_text for x in ['دولار', 'USD', 'أمريكي']): currency = 'usd'
-        elif any(x in row_text for x in ['سعودي', 'SAR']): currency = 'sar'
-        
-        if not currency: continue
-
-        nums.sort()
-        buy = nums[0]
-        sell = nums[1] if len(nums) >= 2 else 0
-
-        region = None
-        if currency == 'usd':
-            if 520 <= buy <= 600: region = 'sanaa'
-            elif 1600 <= buy <= 2200: region = 'aden'
-        elif currency == 'sar':
-            if 138 <= buy <= 160: region = 'sanaa'
-            elif 400 <= buy <= 580: region = 'aden'
-
-        if region:
-            page_data[region][currency].append({'buy': buy, 'sell': sell})
-            log_str = f"{region.upper()} {currency.upper()}: {buy}/{sell}"
-            if log_str not in found_log: found_log.append(log_str)
-
-    if found_log:
-        print(f"   🔹 المصدر: {url_source}")
-        print(f"      وجدنا: {', '.join(found_log)}")
-    
-    return page_data
-
 async def scrape_market_data():
     print("\n🕷️ --- تقرير سحب المواقع ---")
     
@@ -171,50 +126,27 @@ async def scrape_market_data():
     
     headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'}
     
-    data_pool = {
-        'sanaa': {'usd_buy': [], 'usd_sell': [], 'sar_buy': [], 'sar_sell': []},
-        'aden': {'usd_buy': [], 'usd_sell': [], 'sar_buy': [], 'sar_sell': []}
-    }
+    data_pool = empty_pool()
 
     async with aiohttp.ClientSession(headers=headers) as session:
         tasks = [fetch_url(session, url) for url in sources]
         results = await asyncio.gather(*tasks)
 
+    # أرشفة الصفحات الخام (اختياري) لاختبار تعديلات التحليل لاحقاً عبر replay.py
+    if CAPTURE_DIR:
+        try:
+            run_time = datetime.utcnow() + timedelta(hours=3)
+            save_captures(CAPTURE_DIR, run_time, list(zip(sources, results)))
+        except Exception as e:
+            logger.warning(f"⚠️ فشل حفظ أرشيف الصفحات: {e}")
+
     for url, html in zip(sources, results):
         if not html: continue
         extracted = parse_rates_from_html(html, url)
-        
-        for region in ['sanaa', 'aden']:
-            for curr in ['usd', 'sar']:
-                for item in extracted[region][curr]:
-                    data_pool[region][f'{curr}_buy'].append(item['buy'])
-                    if item['sell'] > item['buy']:
-                        data_pool[region][f'{curr}_sell'].append(item['sell'])
+        add_to_pool(data_pool, extracted)
 
     return data_pool
 
-def calculate_final_rate(values_list, label=""):
-    if not values_list: 
-        print(f"   ⚠️ {label}: لا توجد بيانات.")
-        return None
-    
-    values_list.sort()
-    if len(values_list) < 3: 
-        avg = int(sum(values_list)/len(values_list))
-        print(f"   📊 {label}: {values_list} -> المتوسط: {avg}")
-        return avg
-    
-    mid = len(values_list)//2
-    median = values_list[mid]
-    clean = [x for x in values_list if median*0.85 <= x <= median*1.15]
-    final_val = int(sum(clean)/len(clean)) if clean else int(median)
-    
-    print(f"   📊 {label}:")
-    print(f"      - الكل: {values_list}")
-    print(f"      - النتيجة: {final_val}")
-    
-    return final_val
-
 # ==========================================
 # 4. محرك الذهب (Yahoo Finance - GC=F) 🟡
 # ==========================================
@@ -269,6 +201,9 @@ def calculate_gold_updates(sanaa_usd, aden_usd):
 # ==========================================
 # 5. التنفيذ الرئيسي
 # ==========================================
+outbox = None
+stats = None
+
 try:
     # 1. سحب البيانات
     raw_data = asyncio.run(scrape_market_data())
@@ -308,102 +243,139 @@ try:
     if new_aden_usd_sell <= new_aden_usd_buy: new_aden_usd_sell = new_aden_usd_buy + SPREAD_ADEN_USD
     if new_aden_sar_sell <= new_aden_sar_buy: new_aden_sar_sell = new_aden_sar_buy + SPREAD_ADEN_SAR
 
-    # جلب القديم للمؤشر (عملات + ذهب)
+    # القيم السابقة للمؤشر من المخزن المحلي (بدون قراءة إضافية من Firebase)
     ref = db.reference('/')
-    old_data = ref.child('rates').get()
-    old_gold = ref.child('gold').get() # 👈 جلب بيانات الذهب القديمة
-
-    old_sanaa = old_data.get('sanaa', {}).get('usd_buy', 535) if old_data else 535
-    old_aden = old_data.get('aden', {}).get('usd_buy', 1630) if old_data else 1630
-    
-    # جلب سعر الأونصة القديم
-    old_ounce = old_gold.get('global_ounce_usd', 4189) if old_gold else 4189
+    outbox = open_outbox(current_dir)
+    stats = open_stats(current_dir)
+    old_sanaa = stats.previous('sanaa/usd')
+    old_aden = stats.previous('aden/usd')
+
+    if old_sanaa is None or old_aden is None:
+        # أول تشغيل (أو فُقد المخزن): نرجع لآخر سعر منشور في Firebase
+        try:
+            old_data = ref.child('rates').get()
+        except Exception as e:
+            # Firebase غير متاح: نكمل بالقيم الافتراضية ونحفظ النتائج في صندوق الإرسال
+            logger.warning(f"⚠️ تعذر جلب البيانات القديمة: {e}")
+            old_data = None
+        if old_sanaa is None:
+            old_sanaa = old_data.get('sanaa', {}).get('usd_buy', 535) if old_data else 535
+        if old_aden is None:
+            old_aden = old_data.get('aden', {}).get('usd_buy', 1630) if old_data else 1630
 
     # حساب مؤشرات العملات
-    trend_sanaa = 1 if new_sanaa_usd_buy > old_sanaa else (-1 if new_sanaa_usd_buy < old_sanaa else 0)
-    trend_aden = 1 if new_aden_usd_buy > old_aden else (-1 if new_aden_usd_buy < old_aden else 0)
-    
+    trend_sanaa = trend_of(new_sanaa_usd_buy, old_sanaa)
+    trend_aden = trend_of(new_aden_usd_buy, old_aden)
+
     # حساب الذهب والوقت
     gold_data = calculate_gold_updates(new_sanaa_usd_buy, new_aden_usd_buy)
     time_now = (datetime.utcnow() + timedelta(hours=3)).strftime("%Y-%m-%d %I:%M %p")
 
     # التحديث
+    # 📊 العينات تُسجل في مخزن الإحصائيات فقط مع التحديث الذي يدخل صندوق الإرسال،
+    # حتى يبقى "السعر السابق" للمؤشر والإشعارات هو آخر سعر نُشر للمستخدمين.
+    updates = {
+        "rates/last_update": time_now,
+
+        "rates/sanaa/usd_buy": new_sanaa_usd_buy,
+        "rates/sanaa/usd_sell": new_sanaa_usd_sell,
+        "rates/sanaa/sar_buy": new_sanaa_sar_buy,
+        "rates/sanaa/sar_sell": new_sanaa_sar_sell,
+        "rates/sanaa/trend": trend_sanaa,
+        "rates/sanaa/stats": {
+            "usd": stats.record('sanaa/usd', new_sanaa_usd_buy),
+            "sar": stats.record('sanaa/sar', new_sanaa_sar_buy),
+        },
+        "rates/sanaa/last_update": time_now,
+
+        "rates/aden/usd_buy": new_aden_usd_buy,
+        "rates/aden/usd_sell": new_aden_usd_sell,
+        "rates/aden/sar_buy": new_aden_sar_buy,
+        "rates/aden/sar_sell": new_aden_sar_sell,
+        "rates/aden/trend": trend_aden,
+        "rates/aden/stats": {
+            "usd": stats.record('aden/usd', new_aden_usd_buy),
+            "sar": stats.record('aden/sar', new_aden_sar_buy),
+        },
+        "rates/aden/last_update": time_now,
+    }
+
+    # نستخدم التاريخ فقط (بدون الوقت) كمفتاح، لنحفظ سعراً واحداً لكل يوم (سعر الإغلاق)
+    today_date = (datetime.utcnow() + timedelta(hours=3)).strftime("%Y-%m-%d")
+
+    history_updates = {
+        # سجل صنعاء
+        f"history/sanaa/usd/{today_date}": new_sanaa_usd_buy,
+        f"history/sanaa/sar/{today_date}": new_sanaa_sar_buy,
+
+        # سجل عدن
+        f"history/aden/usd/{today_date}": new_aden_usd_buy,
+        f"history/aden/sar/{today_date}": new_aden_sar_buy,
+    }
+
+    gold_status = "بدون ذهب"
     if gold_data:
-        # 👇 حساب مؤشر الذهب (Gold Trend)
-        new_ounce = gold_data['global_ounce_usd']
-        gold_trend = 0
-        if new_ounce > old_ounce: gold_trend = 1
-        elif new_ounce < old_ounce: gold_trend = -1
+        # 👇 مؤشر الذهب لكل مدينة حسب سعر جرام 21 فيها
+        gold_trend_sanaa = trend_of(gold_data['sanaa']['gram_21'], stats.previous('sanaa/gold21'))
+        gold_trend_aden = trend_of(gold_data['aden']['gram_21'], stats.previous('aden/gold21'))
         
         # إضافة التواريخ والمؤشر للذهب
         gold_data['sanaa']['last_update'] = time_now
-        gold_data['sanaa']['trend'] = gold_trend # 👈 مؤشر ذهب صنعاء
+        gold_data['sanaa']['trend'] = gold_trend_sanaa # 👈 مؤشر ذهب صنعاء
         
         gold_data['aden']['last_update'] = time_now
-        gold_data['aden']['trend'] = gold_trend  # 👈 مؤشر ذهب عدن
-
-        updates = {
-            "rates/last_update": time_now,
-            "gold": gold_data,
-
-            "rates/sanaa/usd_buy": new_sanaa_usd_buy,
-            "rates/sanaa/usd_sell": new_sanaa_usd_sell,
-            "rates/sanaa/sar_buy": new_sanaa_sar_buy,
-            "rates/sanaa/sar_sell": new_sanaa_sar_sell,
-            "rates/sanaa/trend": trend_sanaa,
-            "rates/sanaa/last_update": time_now,
-
-            "rates/aden/usd_buy": new_aden_usd_buy,
-            "rates/aden/usd_sell": new_aden_usd_sell,
-            "rates/aden/sar_buy": new_aden_sar_buy,
-            "rates/aden/sar_sell": new_aden_sar_sell,
-            "rates/aden/trend": trend_aden,
-            "rates/aden/last_update": time_now,
-        }
-
-        ref.update(updates)
-        logger.info(f"✅ تم التحديث بنجاح! (Gold Trend: {gold_trend})")
-        print(f"\n✅ تم التحديث بنجاح! (Gold Trend: {gold_trend})")
-
-        # ==========================================
-        # 🆕 6. حفظ السجل التاريخي (History) 📈
-        # ==========================================
-        # نستخدم التاريخ فقط (بدون الوقت) كمفتاح، لنحفظ سعراً واحداً لكل يوم (سعر الإغلاق)
-        today_date = (datetime.utcnow() + timedelta(hours=3)).strftime("%Y-%m-%d")
-        
-        history_updates = {
-            # سجل صنعاء
-            f"history/sanaa/usd/{today_date}": new_sanaa_usd_buy,
-            f"history/sanaa/sar/{today_date}": new_sanaa_sar_buy,
-            f"history/sanaa/gold21/{today_date}": gold_data['sanaa']['gram_21'],
-            
-            # سجل عدن
-            f"history/aden/usd/{today_date}": new_aden_usd_buy,
-            f"history/aden/sar/{today_date}": new_aden_sar_buy,
-            f"history/aden/gold21/{today_date}": gold_data['aden']['gram_21'],
-        }
-        
-        # نستخدم update لكي لا نحذف الأيام السابقة
-        ref.update(history_updates)
+        gold_data['aden']['trend'] = gold_trend_aden  # 👈 مؤشر ذهب عدن
+
+        # 📊 إحصائيات الذهب
+        gold_data['stats'] = stats.record('gold/ounce', gold_data['global_ounce_usd'])
+        gold_data['sanaa']['stats'] = stats.record('sanaa/gold21', gold_data['sanaa']['gram_21'])
+        gold_data['aden']['stats'] = stats.record('aden/gold21', gold_data['aden']['gram_21'])
+
+        updates["gold"] = gold_data
+        history_updates[f"history/sanaa/gold21/{today_date}"] = gold_data['sanaa']['gram_21']
+        history_updates[f"history/aden/gold21/{today_date}"] = gold_data['aden']['gram_21']
+        gold_status = f"Gold Trend: {gold_trend_sanaa}/{gold_trend_aden}"
+
+    # نسجل التحديث محلياً قبل إرساله، ليُعاد تلقائياً إن فشل الاتصال
+    published = outbox.publish(ref, updates)
+    stats.save()
+    if published:
+        logger.info(f"✅ تم التحديث بنجاح! ({gold_status})")
+        print(f"\n✅ تم التحديث بنجاح! ({gold_status})")
+    else:
+        print("\n⚠️ فشل الاتصال بـ Firebase، تم حفظ التحديث في صندوق الإرسال لإعادته لاحقاً.")
+
+    # ==========================================
+    # 🆕 6. حفظ السجل التاريخي (History) 📈
+    # ==========================================
+    # نستخدم update لكي لا نحذف الأيام السابقة
+    if not published:
+        # لا نعيد المحاولة الآن (مهلة اتصال أخرى)، يُرسل السجل مع التحديث في التشغيل القادم
+        outbox.enqueue(history_updates)
+    elif outbox.publish(ref, history_updates):
         logger.info(f"📈 تم حفظ سجل الأسعار ليوم: {today_date}")
         print(f"📈 تم حفظ سجل الأسعار ليوم: {today_date}")
 
-        # الإشعارات
-        if abs(new_aden_usd_buy - old_aden) > 2 or abs(new_sanaa_usd_buy - old_sanaa) > 1:
-            arrow = "🔺" if (new_aden_usd_buy > old_aden) else "🔻"
-            msg = messaging.Message(
-                notification=messaging.Notification(
-                    title=f"{arrow} تحديث أسعار الصرف", 
-                    body=f"صنعاء: {new_sanaa_usd_buy} | عدن: {new_aden_usd_buy}"
-                ), 
-                topic='rates'
-            )
-            try: 
-                messaging.send(msg)
-                logger.info("✅ تم إرسال الإشعار للمستخدمين")
-            except Exception as e:
-                logger.error(f"❌ فشل إرسال الإشعار: {e}")
+    # الإشعارات (فقط إذا وصلت الأسعار الجديدة إلى Firebase)
+    if published and (abs(new_aden_usd_buy - old_aden) > 2 or abs(new_sanaa_usd_buy - old_sanaa) > 1):
+        arrow = "🔺" if (new_aden_usd_buy > old_aden) else "🔻"
+        msg = messaging.Message(
+            notification=messaging.Notification(
+                title=f"{arrow} تحديث أسعار الصرف", 
+                body=f"صنعاء: {new_sanaa_usd_buy} | عدن: {new_aden_usd_buy}"
+            ), 
+            topic='rates'
+        )
+        try: 
+            messaging.send(msg)
+            logger.info("✅ تم إرسال الإشعار للمستخدمين")
+        except Exception as e:
+            logger.error(f"❌ فشل إرسال الإشعار: {e}")
 
 except Exception as e:
     logger.error(f"❌ خطأ في التنفيذ الرئيسي: {e}", exc_info=True)
-    print(f"❌ Error: {e}")
\ No newline at end of file
+    print(f"❌ Error: {e}")
+finally:
+    # إغلاق صندوق الإرسال ومخزن الإحصائيات حتى في حالة الخطأ (يُحفظ بعدها في كاش GitHub Actions)
+    if outbox: outbox.close()
+    if stats: stats.close()
@@ -6,6 +6,8 @@ import yfinance as yf
 import sys
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
+from outbox import open_outbox
+from stats import open_stats, trend_of
 
 # ==========================================
 # إعداد نظام Logging
@@ -73,6 +75,8 @@ def calculate_gold(usd_buy_rate):
 # ==========================================
 # 3. التشغيل الرئيسي (تحديث شامل)
 # ==========================================
+stats = None
+
 try:
     # التحقق من المدخلات
     if len(sys.argv) < 7:
@@ -117,16 +121,21 @@ try:
 
     ref = db.reference('/')
     
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    stats = open_stats(base_dir)
+
     # 1. جلب السعر القديم لحساب المؤشر (نعتمد على الدولار كمقياس)
-    old_price_snapshot = ref.child(f'rates/{city}/usd_buy').get()
-    old_price = float(old_price_snapshot) if old_price_snapshot is not None else usd_buy
+    old_price = stats.previous(f'{city}/usd')
+    if old_price is None:
+        try:
+            old_price_snapshot = ref.child(f'rates/{city}/usd_buy').get()
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر جلب السعر القديم: {e}")
+            old_price_snapshot = None
+        old_price = float(old_price_snapshot) if old_price_snapshot is not None else usd_buy
     
     # 2. حساب المؤشر
-    trend = 0
-    if usd_buy > old_price:
-        trend = 1     # صعود
-    elif usd_buy < old_price:
-        trend = -1    # هبوط
+    trend = trend_of(usd_buy, old_price)
     
     # 3. الوقت
     yemen_time = datetime.utcnow() + timedelta(hours=3)
@@ -139,6 +148,10 @@ try:
         f"rates/{city}/sar_buy": sar_buy,
         f"rates/{city}/sar_sell": sar_sell,
         f"rates/{city}/trend": trend,
+        f"rates/{city}/stats": {
+            "usd": stats.record(f'{city}/usd', usd_buy),
+            "sar": stats.record(f'{city}/sar', sar_buy),
+        },
         "rates/last_update": formatted_time,
         f"rates/{city}/last_update": formatted_time
     }
@@ -150,11 +163,28 @@ try:
         updates[f"gold/{city}/gram_21"] = gold_data['gram_21']
         updates[f"gold/{city}/gunaih"] = gold_data['gunaih']
         updates[f"gold/{city}/last_update"] = formatted_time
+        updates[f"gold/{city}/trend"] = trend_of(gold_data['gram_21'], stats.previous(f'{city}/gold21'))
+        updates[f"gold/{city}/stats"] = stats.record(f'{city}/gold21', gold_data['gram_21'])
         updates["gold/global_ounce_usd"] = gold_data['global_ounce']
         logger.info(f"✅ تم حساب الذهب: جرام 21 = {gold_data['gram_21']:,}")
 
-    # 6. التنفيذ
-    ref.update(updates)
+    stats.save()
+
+    # 6. التنفيذ (عبر صندوق الإرسال حتى لا يضيع الإدخال اليدوي إن فشل الاتصال)
+    outbox = open_outbox(base_dir)
+    try:
+        published = outbox.publish(ref, updates)
+    finally:
+        outbox.close()
+    if not published:
+        # إبلاغ GitHub Actions بحفظ صندوق الإرسال في الكاش (انظر manual.yml)
+        github_output = os.getenv('GITHUB_OUTPUT')
+        if github_output:
+            with open(github_output, 'a') as f:
+                f.write("queued=true\n")
+        print("❌ فشل الاتصال بـ Firebase، تم حفظ التحديث في صندوق الإرسال وسيُعاد في التشغيل المجدول القادم.")
+        print(f"::error::لم يصل تحديث {city} إلى Firebase. تأكد من ظهوره بعد التشغيل المجدول القادم، وإلا أعد إدخاله.")
+        exit(1)
     logger.info(f"✅ تم التحديث بنجاح! (Trend: {trend})")
     print(f"✅ تم التحديث الشامل بنجاح! (Trend: {trend})")
 
@@ -198,4 +228,6 @@ except KeyboardInterrupt:
 except Exception as e:
     logger.error(f"❌ خطأ غير متوقع: {e}", exc_info=True)
     print(f"❌ Error: {e}")
-    exit(1)
\ No newline at end of file
+    exit(1)
+finally:
+    if stats: stats.close()
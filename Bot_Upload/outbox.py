@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# صندوق الإرسال المحلي (Outbox) 📮
+# ==========================================
+# كل تحديث يُكتب أولاً في SQLite (وضع WAL) ثم يُرسل إلى Firebase.
+# إذا فشل الإرسال تبقى الإدخالات معلّقة، وتُعاد في أول تشغيل ناجح
+# كتحديث واحد مجمّع (أحدث قيمة لكل مسار فقط).
+
+DEFAULT_OUTBOX_FILE = "outbox.db"
+
+
+def _merge_path(merged, path, value):
+    """
+    يضيف (path -> value) إلى قاموس التحديث مع منع تداخل المسارات،
+    لأن Firebase يرفض تحديثاً يحتوي على مسار ومسار فرعي منه معاً.
+    """
+    prefix = path + "/"
+
+    # القيمة الأحدث لمسار أب تلغي كل ما سبقها من مساراته الفرعية
+    for key in [k for k in merged if k.startswith(prefix)]:
+        del merged[key]
+
+    # إن كان هناك مسار أب سابق، ندمج القيمة الأحدث داخله
+    for key in merged:
+        if path.startswith(key + "/"):
+            node = merged[key]
+            if not isinstance(node, dict):
+                node = {}
+            merged[key] = node
+            parts = path[len(key) + 1:].split("/")
+            for part in parts[:-1]:
+                child = node.get(part)
+                if not isinstance(child, dict):
+                    child = {}
+                    node[part] = child
+                node = child
+            node[parts[-1]] = value
+            return
+
+    merged[path] = value
+
+
+class Outbox:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pending ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " path TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL)"
+        )
+        self.conn.commit()
+
+    def _checkpoint(self):
+        # دمج ملف WAL في outbox.db فوراً، حتى لو توقف التشغيل قبل close()
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        self.conn.close()
+
+    def enqueue(self, updates):
+        """تسجيل التحديثات قبل إرسالها (Write-Ahead)"""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO pending (path, value, created_at) VALUES (?, ?, ?)",
+                [(path.strip("/"), json.dumps(value, ensure_ascii=False), now)
+                 for path, value in updates.items()]
+            )
+        self._checkpoint()
+
+    def pending_updates(self):
+        """
+        يرجع (آخر id، التحديث المجمّع) لكل الإدخالات المعلّقة،
+        مع الإبقاء على أحدث قيمة فقط لكل مسار.
+        """
+        rows = self.conn.execute(
+            "SELECT id, path, value FROM pending ORDER BY id"
+        ).fetchall()
+        if not rows:
+            return None, {}
+
+        merged = {}
+        for _, path, value in rows:
+            _merge_path(merged, path, json.loads(value))
+        return rows[-1][0], merged
+
+    def flush(self, ref):
+        """
+        إرسال كل المعلّق كتحديث واحد. الحذف يتم فقط بعد نجاح الإرسال،
+        وإعادة نفس التحديث لا تغيّر النتيجة (القيم مطلقة وليست تراكمية).
+        """
+        last_id, merged = self.pending_updates()
+        if last_id is None:
+            return True
+
+        oldest = self.conn.execute(
+            "SELECT MIN(created_at) FROM pending WHERE id <= ?", (last_id,)
+        ).fetchone()[0]
+
+        start = time.monotonic()
+        try:
+            ref.update(merged)
+        except Exception as e:
+            logger.error(f"❌ فشل إرسال صندوق الإرسال ({len(merged)} مسار): {e}")
+            return False
+        latency_ms = (time.monotonic() - start) * 1000
+
+        with self.conn:
+            self.conn.execute("DELETE FROM pending WHERE id <= ?", (last_id,))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                [
+                    ("last_replay_at", time.time()),
+                    ("last_replay_latency_ms", latency_ms),
+                    ("last_replay_paths", len(merged)),
+                    ("last_replay_max_age_s", time.time() - oldest),
+                ]
+            )
+        self._checkpoint()
+        return True
+
+    def publish(self, ref, updates):
+        """تسجيل ثم إرسال (مع أي تحديثات سابقة لم تُرسل)"""
+        self.enqueue(updates)
+        ok = self.flush(ref)
+        m = self.metrics()
+        logger.info(
+            f"📮 Outbox: depth={m['queue_depth']} "
+            f"replay_latency_ms={m['last_replay_latency_ms']:.0f} "
+            f"replay_paths={m['last_replay_paths']:.0f} "
+            f"max_age_s={m['last_replay_max_age_s']:.0f}"
+        )
+        return ok
+
+    def metrics(self):
+        depth, oldest = self.conn.execute(
+            "SELECT COUNT(*), MIN(created_at) FROM pending"
+        ).fetchone()
+        stats = {
+            "queue_depth": depth,
+            "oldest_pending_age_s": (time.time() - oldest) if oldest else 0.0,
+            "last_replay_at": 0.0,
+            "last_replay_latency_ms": 0.0,
+            "last_replay_paths": 0.0,
+            "last_replay_max_age_s": 0.0,
+        }
+        for key, value in self.conn.execute("SELECT key, value FROM meta"):
+            stats[key] = value
+        return stats
+
+
+def open_outbox(base_dir):
+    path = os.getenv("OUTBOX_PATH") or os.path.join(base_dir, DEFAULT_OUTBOX_FILE)
+    return Outbox(path)
@@ -0,0 +1,91 @@
+from bs4 import BeautifulSoup
+import re
+
+# ==========================================
+# استخراج الأسعار وتجميعها 🔍
+# ==========================================
+# دوال بدون آثار جانبية (لا Firebase ولا .env) ليستخدمها main.py
+# وأداة إعادة التشغيل replay.py على الصفحات المؤرشفة.
+
+def empty_pool():
+    return {
+        'sanaa': {'usd_buy': [], 'usd_sell': [], 'sar_buy': [], 'sar_sell': []},
+        'aden': {'usd_buy': [], 'usd_sell': [], 'sar_buy': [], 'sar_sell': []}
+    }
+
+def parse_rates_from_html(html, url_source, verbose=True):
+    soup = BeautifulSoup(html, 'html.parser')
+    page_data = {
+        'sanaa': {'usd': [], 'sar': []},
+        'aden': {'usd': [], 'sar': []}
+    }
+
+    rows = soup.find_all(['tr', 'div', 'p', 'span'])
+    found_log = []
+
+    for row in rows:
+        row_text = row.get_text().strip()
+        nums = [int(n) for n in re.findall(r'\d{3,4}', row_text)]
+        nums = [n for n in nums if n not in list(range(2010, 2031))]
+
+        if len(nums) < 1: continue
+
+        currency = None
+        if any(x in row_text for x in ['دولار', 'USD', 'أمريكي']): currency = 'usd'
+        elif any(x in row_text for x in ['سعودي', 'SAR']): currency = 'sar'
+
+        if not currency: continue
+
+        nums.sort()
+        buy = nums[0]
+        sell = nums[1] if len(nums) >= 2 else 0
+
+        region = None
+        if currency == 'usd':
+            if 520 <= buy <= 600: region = 'sanaa'
+            elif 1600 <= buy <= 2200: region = 'aden'
+        elif currency == 'sar':
+            if 138 <= buy <= 160: region = 'sanaa'
+            elif 400 <= buy <= 580: region = 'aden'
+
+        if region:
+            page_data[region][currency].append({'buy': buy, 'sell': sell})
+            log_str = f"{region.upper()} {currency.upper()}: {buy}/{sell}"
+            if log_str not in found_log: found_log.append(log_str)
+
+    if found_log and verbose:
+        print(f"   🔹 المصدر: {url_source}")
+        print(f"      وجدنا: {', '.join(found_log)}")
+
+    return page_data
+
+def add_to_pool(data_pool, extracted):
+    for region in ['sanaa', 'aden']:
+        for curr in ['usd', 'sar']:
+            for item in extracted[region][curr]:
+                data_pool[region][f'{curr}_buy'].append(item['buy'])
+                if item['sell'] > item['buy']:
+                    data_pool[region][f'{curr}_sell'].append(item['sell'])
+
+def calculate_final_rate(values_list, label="", verbose=True):
+    if not values_list:
+        if verbose: print(f"   ⚠️ {label}: لا توجد بيانات.")
+        return None
+
+    values_list.sort()
+    if len(values_list) < 3:
+        avg = int(sum(values_list)/len(values_list))
+        if verbose: print(f"   📊 {label}: {values_list} -> المتوسط: {avg}")
+        return avg
+
+    mid = len(values_list)//2
+    median = values_list[mid]
+    clean = [x for x in values_list if median*0.85 <= x <= median*1.15]
+    final_val = int(sum(clean)/len(clean)) if clean else int(median)
+
+    if verbose:
+        print(f"   📊 {label}:")
+        print(f"      - الكل: {values_list}")
+        print(f"      - النتيجة: {final_val}")
+
+    return final_val
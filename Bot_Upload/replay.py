@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+
+from archive import iter_captures
+from parsing import parse_rates_from_html, add_to_pool, calculate_final_rate, empty_pool
+
+# ==========================================
+# إعادة تشغيل الأرشيف (Historical Replay) ⏪
+# ==========================================
+# يعيد تحليل الصفحات المؤرشفة (CAPTURE_DIR) بالكود الحالي في parsing.py
+# على كل الأنوية، ثم يقارن النتائج بما نُشر فعلاً في history/.
+#
+# الاستخدام:
+#   gh run download --pattern 'captures-*' --dir captures/   # أرشيف التشغيل المجدول
+#   python replay.py captures/ --history history.json
+# ملف history.json تصدير للعقدة history من Firebase (أو لقاعدة البيانات كاملة).
+
+SERIES = [('sanaa', 'usd'), ('sanaa', 'sar'), ('aden', 'usd'), ('aden', 'sar')]
+
+
+def extract_chunk(records):
+    """يعمل داخل العمليات الفرعية: يرجع الأسعار المستخرجة فقط وليس الـ HTML"""
+    return [
+        (r['run'], r['url'], parse_rates_from_html(r['html'], r['url'], verbose=False))
+        for r in records
+    ]
+
+
+def iter_extracted(paths, workers, chunksize):
+    """
+    توزيع السجلات على العمليات مع إبقاء عدد محدود من الدفعات قيد التنفيذ،
+    حتى لا يُقرأ الأرشيف كله في الذاكرة، مع الحفاظ على الترتيب الزمني.
+    """
+    records = iter_captures(paths)
+    max_inflight = workers * 4
+
+    with Pool(workers) as pool:
+        inflight = deque()
+        while True:
+            while len(inflight) < max_inflight:
+                chunk = list(islice(records, chunksize))
+                if not chunk: break
+                inflight.append(pool.apply_async(extract_chunk, (chunk,)))
+            if not inflight: break
+            yield from inflight.popleft().get()
+
+
+def load_history(path):
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    return data.get('history', data)
+
+
+class ErrorStats:
+    def __init__(self):
+        self.count = 0
+        self.abs_err = 0.0
+        self.abs_pct = 0.0
+        self.exact = 0
+
+    def add(self, value, published):
+        diff = abs(value - published)
+        self.count += 1
+        self.abs_err += diff
+        self.abs_pct += diff / published * 100 if published else 0
+        if diff == 0: self.exact += 1
+
+    def as_dict(self):
+        if not self.count: return {"count": 0}
+        return {
+            "count": self.count,
+            "mae": round(self.abs_err / self.count, 2),
+            "mape": round(self.abs_pct / self.count, 2),
+            "exact": self.exact,
+        }
+
+
+def final_rates(pool):
+    return {
+        f"{region}/{curr}": calculate_final_rate(pool[region][f'{curr}_buy'], verbose=False)
+        for region, curr in SERIES
+    }
+
+
+def run_replay(paths, history, workers, chunksize):
+    # history/ يحفظ سعر الإغلاق فقط (آخر تشغيل في اليوم)، لذلك نقيّم آخر تشغيل
+    # لكل يوم فقط، حتى لا تختلط حركة السعر خلال اليوم بدقة التحليل.
+    per_source = {}      # (المصدر، السلسلة) -> ErrorStats
+    source_runs = {}
+    source_misses = {}
+    aggregate = {f"{r}/{c}": ErrorStats() for r, c in SERIES}
+    diffs = []
+    days = 0
+    records = 0
+
+    current_run, run_pool, run_sources = None, None, None
+    last_of_day = None   # (اليوم، التجميع، وسيط كل مصدر) لآخر تشغيل مكتمل
+
+    def score_day(day, finals, sources):
+        for key, value in finals.items():
+            region, curr = key.split('/')
+            published = history.get(region, {}).get(curr, {}).get(day)
+            if published is None: continue
+            for url, medians in sources.items():
+                if key in medians:
+                    per_source.setdefault((url, key), ErrorStats()).add(medians[key], published)
+            if value is None: continue
+            aggregate[key].add(value, published)
+            if value != published:
+                diffs.append({"date": day, "series": key, "replay": value, "published": published})
+
+    def close_run():
+        nonlocal last_of_day, days
+        if current_run is None: return
+        day = current_run[:10]
+        if last_of_day and last_of_day[0] != day:
+            score_day(*last_of_day)
+        if not last_of_day or last_of_day[0] != day:
+            days += 1
+        last_of_day = (day, final_rates(run_pool), run_sources)
+
+    for run, url, extracted in iter_extracted(paths, workers, chunksize):
+        records += 1
+        if run != current_run:
+            close_run()
+            current_run, run_pool, run_sources = run, empty_pool(), {}
+        add_to_pool(run_pool, extracted)
+
+        source_runs[url] = source_runs.get(url, 0) + 1
+        medians = {}
+        for region, curr in SERIES:
+            buys = [item['buy'] for item in extracted[region][curr]]
+            if buys: medians[f"{region}/{curr}"] = statistics.median(buys)
+        if medians:
+            run_sources[url] = medians
+        else:
+            source_misses[url] = source_misses.get(url, 0) + 1
+    close_run()
+    if last_of_day:
+        score_day(*last_of_day)
+
+    sources = {}
+    for url, runs in source_runs.items():
+        sources[url] = {
+            "snapshots": runs,
+            "no_data": source_misses.get(url, 0),
+            "series": {key: s.as_dict() for (u, key), s in per_source.items() if u == url},
+        }
+
+    return {
+        "records": records,
+        "days": days,
+        "aggregate": {key: s.as_dict() for key, s in aggregate.items()},
+        "sources": sources,
+        "diffs": diffs,
+    }
+
+
+def print_report(report):
+    print("\n⏪ --- تقرير إعادة التشغيل ---")
+    print(f"   السجلات: {report['records']} | الأيام: {report['days']}")
+
+    print("\n📊 التجميع النهائي مقابل history/:")
+    for key, s in report['aggregate'].items():
+        if not s['count']: continue
+        print(f"   {key:10} أيام={s['count']:<5} مطابق={s['exact']:<5} MAE={s['mae']:<8} MAPE={s['mape']}%")
+
+    print("\n🔹 دقة المصادر:")
+    for url, info in sorted(report['sources'].items()):
+        print(f"   {url}  (لقطات={info['snapshots']}, بدون بيانات={info['no_data']})")
+        for key, s in sorted(info['series'].items()):
+            if not s['count']: continue
+            print(f"      {key:10} أيام={s['count']:<5} MAE={s['mae']:<8} MAPE={s['mape']}%")
+
+    if report['diffs']:
+        print(f"\n⚠️ أيام تختلف عن المنشور: {len(report['diffs'])}")
+        for d in report['diffs'][:20]:
+            print(f"   {d['date']} {d['series']}: replay={d['replay']} published={d['published']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="إعادة تحليل الصفحات المؤرشفة ومقارنتها بالسجل المنشور")
+    parser.add_argument('captures', nargs='+', help="مجلد أو ملفات الأرشيف (*.jsonl.gz)")
+    parser.add_argument('--history', required=True, help="تصدير JSON للعقدة history من Firebase")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunksize', type=int, default=16)
+    parser.add_argument('--output', help="حفظ التقرير الكامل بصيغة JSON")
+    args = parser.parse_args(argv)
+
+    history = load_history(args.history)
+    report = run_replay(args.captures, history, args.workers, args.chunksize)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 تم حفظ التقرير في: {args.output}")
+
+
+if __name__ == '__main__':
+    sys.stdout.reconfigure(encoding='utf-8')
+    main()
@@ -0,0 +1,203 @@
+import math
+import os
+import sqlite3
+import time
+from array import array
+
+# ==========================================
+# إحصائيات متعددة الفترات (Ring Buffers) 📊
+# ==========================================
+# لكل مدينة وأداة مخزن دائري بحجم ثابت (مصفوفات array) يُحفظ بين التشغيلات،
+# ومنه نحسب التغير خلال 1h/24h/7d، وأعلى/أدنى سعر منذ منتصف الليل بتوقيت اليمن
+# (نفس حدود اليوم في history/)، ومتوسط وتذبذب آخر 24 ساعة، بشكل تراكمي
+# دون الرجوع إلى السجل في Firebase.
+
+DEFAULT_STATS_FILE = "stats.db"
+
+# 512 عينة تغطي أكثر من 10 أيام بمعدل تشغيل كل 30 دقيقة
+CAPACITY = 512
+WINDOW_SECONDS = 24 * 3600
+YEMEN_UTC_OFFSET = 3 * 3600
+HORIZONS = {
+    "1h": 3600,
+    "24h": 24 * 3600,
+    "7d": 7 * 24 * 3600,
+}
+
+
+def yemen_day(ts):
+    """رقم اليوم بتوقيت اليمن (UTC+3)، يتغير عند منتصف الليل كما في history/"""
+    return int((ts + YEMEN_UTC_OFFSET) // 86400)
+
+
+class RingBuffer:
+    def __init__(self, capacity=CAPACITY, window=WINDOW_SECONDS):
+        self.capacity = capacity
+        self.window = window
+        self.ts = array('d', bytes(8 * capacity))
+        self.vals = array('d', bytes(8 * capacity))
+        self.seq = 0            # عدد العينات الكلي (الموضع التالي = seq % capacity)
+        self.size = 0
+
+        # نافذة الـ 24 ساعة: مجموع ومجموع مربعات للمتوسط والتذبذب
+        self.win_start = 0
+        self.win_sum = 0.0
+        self.win_sumsq = 0.0
+
+        # أعلى/أدنى اليوم الحالي (بتوقيت اليمن)
+        self.day = -1
+        self.day_high = 0.0
+        self.day_low = 0.0
+
+    def _at(self, seq):
+        i = seq % self.capacity
+        return self.ts[i], self.vals[i]
+
+    def _evict_window_head(self):
+        _, v = self._at(self.win_start)
+        self.win_sum -= v
+        self.win_sumsq -= v * v
+        self.win_start += 1
+
+    def last(self):
+        if not self.size: return None
+        return self._at(self.seq - 1)[1]
+
+    def push(self, ts, value):
+        value = float(value)
+
+        # المخزن ممتلئ: العينة الأقدم ستُستبدل، فنخرجها من النافذة أولاً
+        if self.size == self.capacity and self.win_start == self.seq - self.size:
+            self._evict_window_head()
+
+        i = self.seq % self.capacity
+        self.ts[i] = ts
+        self.vals[i] = value
+        self.seq += 1
+        self.size = min(self.size + 1, self.capacity)
+
+        self.win_sum += value
+        self.win_sumsq += value * value
+
+        day = yemen_day(ts)
+        if day != self.day:
+            self.day, self.day_high, self.day_low = day, value, value
+        else:
+            self.day_high = max(self.day_high, value)
+            self.day_low = min(self.day_low, value)
+
+        while self._at(self.win_start)[0] < ts - self.window:
+            self._evict_window_head()
+
+    def value_at(self, ts):
+        """آخر قيمة مسجلة في وقت ts أو قبله (None إن كان السجل أقصر)"""
+        lo, hi = self.seq - self.size, self.seq
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._at(mid)[0] <= ts: lo = mid + 1
+            else: hi = mid
+        if lo == self.seq - self.size: return None
+        return self._at(lo - 1)[1]
+
+    def summary(self, now):
+        if not self.size: return {}
+
+        current = self.last()
+        n = self.seq - self.win_start
+        mean = self.win_sum / n
+        variance = max(self.win_sumsq / n - mean * mean, 0.0)
+
+        result = {
+            "mean_24h": round(mean, 2),
+            "volatility_24h": round(math.sqrt(variance), 2),
+        }
+        if self.day == yemen_day(now):
+            result["high_today"] = self.day_high
+            result["low_today"] = self.day_low
+
+        for name, seconds in HORIZONS.items():
+            past = self.value_at(now - seconds)
+            if past is None: continue
+            result[f"change_{name}"] = round(current - past, 2)
+            if past:
+                result[f"change_pct_{name}"] = round((current - past) / past * 100, 2)
+
+        return result
+
+    def state(self):
+        """حالة المخزن كما هي (المصفوفات بترتيبها الدائري + حالة النافذة) للحفظ"""
+        return (self.ts.tobytes(), self.vals.tobytes()) + tuple(
+            getattr(self, name) for name in STATE_FIELDS)
+
+    def load_state(self, ts, vals, *fields):
+        # تحميل مباشر بدون إعادة دفع العينات، فتبقى كلفة كل تحديث O(1)
+        self.ts = array('d')
+        self.ts.frombytes(ts)
+        self.vals = array('d')
+        self.vals.frombytes(vals)
+        for name, value in zip(STATE_FIELDS, fields):
+            setattr(self, name, value)
+
+
+# حقول النافذة المحفوظة مع المصفوفات (بنفس ترتيب أعمدة جدول rings)
+STATE_FIELDS = ("seq", "size", "win_start", "win_sum", "win_sumsq", "day", "day_high", "day_low")
+
+
+class StatsStore:
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS rings ("
+            " key TEXT PRIMARY KEY, ts BLOB NOT NULL, vals BLOB NOT NULL,"
+            " seq INTEGER, size INTEGER, win_start INTEGER,"
+            " win_sum REAL, win_sumsq REAL,"
+            " day INTEGER, day_high REAL, day_low REAL)"
+        )
+        self.conn.commit()
+        self.series = {}
+        self.dirty = set()
+
+    def get(self, key):
+        if key not in self.series:
+            buf = RingBuffer()
+            row = self.conn.execute(
+                f"SELECT ts, vals, {', '.join(STATE_FIELDS)} FROM rings WHERE key = ?", (key,)
+            ).fetchone()
+            # نتجاهل الحالة المحفوظة إن تغيّر حجم المخزن (CAPACITY)
+            if row and len(row[0]) == 8 * buf.capacity:
+                buf.load_state(*row)
+            self.series[key] = buf
+        return self.series[key]
+
+    def previous(self, key):
+        return self.get(key).last()
+
+    def record(self, key, value, now=None):
+        """إضافة عينة جديدة وإرجاع الإحصائيات المحدثة"""
+        now = now or time.time()
+        buf = self.get(key)
+        buf.push(now, value)
+        self.dirty.add(key)
+        return buf.summary(now)
+
+    def save(self):
+        with self.conn:
+            for key in self.dirty:
+                self.conn.execute(
+                    f"INSERT OR REPLACE INTO rings VALUES ({', '.join('?' * (3 + len(STATE_FIELDS)))})",
+                    (key,) + self.series[key].state()
+                )
+        self.dirty.clear()
+
+    def close(self):
+        self.conn.close()
+
+
+def open_stats(base_dir):
+    path = os.getenv("STATS_PATH") or os.path.join(base_dir, DEFAULT_STATS_FILE)
+    return StatsStore(path)
+
+
+def trend_of(new_value, old_value):
+    if old_value is None: return 0
+    return 1 if new_value > old_value else (-1 if new_value < old_value else 0)